@@ -4,17 +4,29 @@
 
 import re
 import os
+import mmap
 import sys
+import stat
 import zlib
 import hashlib
 import argparse
 import collections
-import configparser
 import grp, pwd
 from math import ceil
 from fnmatch import fnmatch
 from datetime import datetime
 
+try:
+    # libdeflate bindings: much faster than zlib on single, bounded
+    # buffers, which is exactly what loose objects are
+    import deflate
+except ImportError:
+    deflate = None
+
+# hashlib.sha1 is OpenSSL's EVP implementation whenever Python is linked
+# against it, and OpenSSL already uses the SHA-NI extensions on CPUs that
+# have them. Without OpenSSL this is CPython's builtin SHA-1.
+_sha1_factory = hashlib.sha1
 
 argparser = argparse.ArgumentParser(description="The stupidest content tracker")
 argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
@@ -22,6 +34,17 @@ argsubparsers.required = True
 
 
 def main(argv=sys.argv[1:]):
+    # Only set up the subparser of the command being run. Anything else
+    # (no command, --help, a typo) gets all of them, so that usage and
+    # error messages list every command.
+    if argv and argv[0] in _SUBCMDS:
+        wanted = [argv[0]]
+    else:
+        wanted = _SUBCMDS.keys()
+    for name in wanted:
+        if name not in argsubparsers.choices:
+            _SUBCMDS[name]()
+
     args = argparser.parse_args(argv)
     match args.command:
         case "add":
@@ -68,25 +91,58 @@ class GitRepository(object):
     def __init__(self, path, force=False):
         self.worktree = path
         self.gitdir = os.path.join(path, ".git")
+        # Directories under gitdir known to exist, see repo_dir
+        self._dir_cache = set()
 
         if not (force or os.path.isdir(self.gitdir)):
             raise Exception("Not a Git repository %s" % path)
 
         # Read configuration file in .git/config
-        self.conf = configparser.ConfigParser()
+        self.conf = dict()
         cf = repo_file(self, "config")
 
         if cf and os.path.exists(cf):
-            self.conf.read([cf])
+            self.conf = config_read(cf)
         elif not force:
             raise Exception("Configuration file missing")
 
         if not force:
-            vers = int(self.conf.get("core", "repositoryformatversion"))
+            vers = int(self.conf["core"]["repositoryformatversion"])
             if vers != 0:
                 raise Exception("Unsupported repositoryformatversion %s" % vers)
 
 
+def config_read(path):
+    """Read the INI-style config file at path into a dict of sections,
+    each a dict of keys to string values. We only ever need a couple of
+    values out of .git/config, so this skips configparser entirely."""
+    conf = dict()
+    section = None
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line[0] == "[":
+                # Section names are case-insensitive too, but subsection
+                # names (as in [remote "origin"]) keep their case
+                name, _, subsection = line[1 : line.index("]")].strip().partition(" ")
+                if subsection:
+                    name = name.lower() + " " + subsection.strip()
+                else:
+                    name = name.lower()
+                section = conf.setdefault(name, dict())
+                continue
+            if section is None:
+                raise Exception("Config entry outside of a section in %s" % path)
+            key, _, value = line.partition("=")
+            # Like git, keys are case-insensitive
+            section[key.strip().lower()] = value.strip()
+
+    return conf
+
+
 def repo_path(repo, *path):
     """Compute path under repo's gitdir."""
     # print("In repo path function")
@@ -94,6 +150,16 @@ def repo_path(repo, *path):
     return os.path.join(repo.gitdir, *path)
 
 
+def path_stat(path):
+    """os.stat(path), or None if it can't be stat'ed. Like os.path.exists,
+    any OSError (missing, a file in the way, no permission) counts as
+    nothing being there."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
 def repo_file(repo, *path, mkdir=False):
     """Same as repo_path, but create dirname(*path) if absent.
     For eg, repo_file(r, \"refs\", \"remotes\", \"origin\", \"HEAD\")
@@ -107,13 +173,22 @@ def repo_dir(repo, *path, mkdir=False):
     """Same as repo_path, but mkdir *path if path absent if mkdir."""
     path = repo_path(repo, *path)
 
-    if os.path.exists(path):
-        if os.path.isdir(path):
+    # Object directories get checked over and over by multi-object
+    # commands, so remember the ones we've already seen
+    if path in repo._dir_cache:
+        return path
+
+    # One stat call rather than separate exists and isdir checks
+    st = path_stat(path)
+    if st is not None:
+        if stat.S_ISDIR(st.st_mode):
+            repo._dir_cache.add(path)
             return path
         else:
             raise Exception("Not a directory %s" % path)
     if mkdir:
         os.makedirs(path)
+        repo._dir_cache.add(path)
         return path
     else:
         return None
@@ -149,30 +224,30 @@ def repo_create(path):
         f.write("ref: refs/heads/master\n")
 
     with open(repo_file(repo, "config"), "w") as f:
-        config = repo_default_config()
-        config.write(f)
+        f.write(repo_default_config())
 
     return repo
 
 
 def repo_default_config():
-    ret = configparser.ConfigParser()
-    ret.add_section("core")
-    ret.set("core", "repositoryformatversion", "0")
-    ret.set("core", "filemode", "false")
-    ret.set("core", "bare", "false")
-
-    return ret
-
-
-argsp = argsubparsers.add_parser("init", help="Initialize a new, empty repository.")
-argsp.add_argument(
-    "path",
-    metavar="directory",
-    nargs="?",
-    default=".",
-    help="Where to create the repository.",
-)
+    return (
+        "[core]\n"
+        "repositoryformatversion = 0\n"
+        "filemode = false\n"
+        "bare = false\n"
+        "\n"
+    )
+
+
+def _register_init():
+    argsp = argsubparsers.add_parser("init", help="Initialize a new, empty repository.")
+    argsp.add_argument(
+        "path",
+        metavar="directory",
+        nargs="?",
+        default=".",
+        help="Where to create the repository.",
+    )
 
 
 def cmd_init(args):
@@ -182,22 +257,23 @@ def cmd_init(args):
 def repo_find(path=".", required=True):
     path = os.path.realpath(path)
 
-    if os.path.isdir(os.path.join(path, ".git")):
-        return GitRepository(path)
+    # Walk up from path until we find a directory containing .git.
+    # path is already resolved, so the parent is just its dirname.
+    while True:
+        st = path_stat(os.path.join(path, ".git"))
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            return GitRepository(path)
 
-    # If we haven't returned, recurse in parent if w
-    parent = os.path.realpath(os.path.join(path, ".."))
+        parent = os.path.dirname(path)
 
-    if parent == path:
-        # Base case
-        # os.path.join("/","..") == "/"
-        # If parent==path, then path is root dir
-        if required:
-            raise Exception("No git directory.")
-        else:
-            return None
-    # Recursive Case
-    return repo_find(parent, required)
+        if parent == path:
+            # os.path.dirname("/") == "/"
+            # If parent==path, then path is root dir
+            if required:
+                raise Exception("No git directory.")
+            else:
+                return None
+        path = parent
 
 
 class GitObject(object):
@@ -222,64 +298,162 @@ class GitObject(object):
         pass  # Just do nothing. This is a reasonable default
 
 
+def object_path(repo, sha):
+    """Path of loose object sha in repo. Doesn't check it exists."""
+    # Plain string formatting: os.path.join is measurably slower for
+    # these fixed segments, and this runs for every object read
+    return f"{repo.gitdir}/objects/{sha[:2]}/{sha[2:]}"
+
+
+# Header of a loose object: type, space, size in ASCII, null char
+_OBJECT_HEADER = re.compile(rb"([a-z]+) (\d+)\x00")
+
+
+# Compressed size from which object_read_raw maps object files instead
+# of reading them
+OBJECT_MMAP_THRESHOLD = 64 * 1024
+
+
+def object_read_raw(repo, sha):
+    """Read and decompress object sha from Git repository repo, header
+    included. Return None if there's no such object."""
+
+    path = object_path(repo, sha)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None  # Object not found
+
+    with f:
+        # Setting up a mapping costs more than copying a small file, so
+        # only large objects are decompressed straight from an mmap
+        if os.fstat(f.fileno()).st_size < OBJECT_MMAP_THRESHOLD:
+            return object_decompress(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return object_decompress(mm)
+
+
+def object_parse_header(raw, sha):
+    """Parse and validate the header of raw, the decompressed object sha.
+    Return the object type and the index where its data starts."""
+
+    # Read object type and size in one go
+    m = _OBJECT_HEADER.match(raw)
+    if not m:
+        raise Exception("Malformed object {0}: bad header".format(sha))
+
+    # Validate object size: the size is the number of bytes after the
+    # null char, which is the real size of the file
+    y = m.end()
+    if int(m.group(2)) != len(raw) - y:
+        raise Exception("Malformed object {0}: bad length".format(sha))
+
+    return m.group(1), y
+
+
 def object_read(repo, sha):
     """Read object sha from Git repository repo.
     Return a GitObject whose exact type depends on the object."""
 
-    path = repo_file(repo, "objects", sha[0:2], sha[2:])
-    if not os.path.isfile(path):
+    raw = object_read_raw(repo, sha)
+    if raw is None:
         return None  # Object not found
 
-    with open(path, "rb") as f:
-        raw = zlib.decompress(f.read())
-        # Read object type
-        x = raw.find(b" ")  # index of space
-        object_type = raw[0:x]
-
-        # Read and validate object size
-        y = raw.find(b"\x00", x)  # index of null character
-        # size exists b/w space and null char, size is number of chars after null chars
-        # which is the real size of the file
-        size = int(raw[x:y].decode("ascii"))
-        if size != len(raw) - y - 1:
-            raise Exception("Malformed object {0}: bad length".format(sha))
-
-        # Pick constructor
-        match object_type:
-            case b"commit":
-                c = GitCommit
-            case b"tree":
-                c = GitTree
-            case b"tag":
-                c = GitTag
-            case b"blob":
-                c = GitBlob
-            case _:
-                raise Exception(
-                    "Unknown type {0} for object {1}".format(
-                        object_type.decode("ascii"), sha
-                    )
-                )
-        # Call constructor and return object
-        return c(raw[y + 1 :])
+    object_type, y = object_parse_header(raw, sha)
+
+    # Pick constructor
+    c = _OBJECT_TYPES.get(object_type)
+    if c is None:
+        raise Exception(
+            "Unknown type {0} for object {1}".format(object_type.decode("ascii"), sha)
+        )
+    # Call constructor and return object
+    return c(raw[y:])
+
+
+def object_reader(cls):
+    """Return a function like object_read, specialized for objects we
+    already know are of type cls: it checks the header against cls and
+    calls its constructor directly, without picking one per object."""
+    object_type = cls.object_type
+
+    def read(repo, sha):
+        raw = object_read_raw(repo, sha)
+        if raw is None:
+            return None  # Object not found
+
+        found_type, y = object_parse_header(raw, sha)
+        if found_type != object_type:
+            raise Exception(
+                "Object {0} is not a {1}".format(sha, object_type.decode("ascii"))
+            )
+
+        return cls(raw[y:])
+
+    return read
+
+
+def object_header(object_type, size):
+    """Header preceding the data of a loose object."""
+    return b"%s %d\x00" % (object_type, size)
+
+
+def object_compress(header, data):
+    """Compress an object's header and data into one zlib stream, as
+    stored in loose objects."""
+    if deflate is None:
+        # Feed the two parts separately rather than concatenating them
+        co = zlib.compressobj()
+        return co.compress(header) + co.compress(data) + co.flush()
+    # libdeflate only works on whole buffers
+    return deflate.zlib_compress(header + data)
+
+
+def object_decompress(data):
+    """Decompress the zlib stream of a loose object."""
+    if deflate is None:
+        # Python's zlib objects can't be reset, and reusing one means
+        # copy()ing a pristine template, which is slower than the
+        # one-shot call. So no pooling here.
+        return zlib.decompress(data)
+
+    # libdeflate needs an upper bound on the output size. Start from a
+    # generous guess and grow it, up to the worst ratio deflate allows.
+    limit = len(data) * 1032 + 1024
+    bound = min(len(data) * 16 + 1024, limit)
+    while True:
+        try:
+            return bytes(deflate.zlib_decompress(data, bound))
+        except deflate.DeflateError:
+            if bound >= limit:
+                raise
+            bound = min(bound * 4, limit)
 
 
 def object_write(obj, repo=None):
     # Serialize object data
     data = obj.serialize()
-    # Add header
-    result = obj.object_type + b" " + str(len(data)).encode() + b"\x00" + data
-    # Compute hash
-    sha = hashlib.sha1(result).hexdigest()
+    header = object_header(obj.object_type, len(data))
+    # Compute hash, feeding header and data separately so we don't
+    # build a concatenated copy just to hash it
+    h = _sha1_factory()
+    h.update(header)
+    h.update(data)
+    sha = h.hexdigest()
 
     if repo:
         # Compute path
-        path = repo_file(repo, "objects", sha[0:2], mkdir=True)
+        path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
 
+        # Objects are written one at a time. Without io_uring bindings in
+        # the standard library, queueing writes for later would still
+        # cost the same open/write/close per object, so it isn't done.
         if not os.path.exists(path):
             with open(path, "wb") as f:
                 # Compress and write
-                f.write(zlib.compress(result))
+                f.write(object_compress(header, data))
+            # Objects are read-only, as git makes them
+            os.chmod(path, 0o444)
     return sha
 
 
@@ -289,20 +463,24 @@ class GitBlob(GitObject):
     def serialize(self):
         return self.blobdata
 
-    def serialize(self, data):
+    def deserialize(self, data):
         self.blobdata = data
 
 
-argsp = argsubparsers.add_parser(
-    "cat-file", help="Provide content of repository objects."
-)
-argsp.add_argument(
-    "type",
-    metavar="type",
-    choices=["blob", "commit", "tag", "tree"],
-    help="Specify the type of object",
-)
-argsp.add_argument("object", metavar="object", help="The object to display")
+object_read_blob = object_reader(GitBlob)
+
+
+def _register_cat_file():
+    argsp = argsubparsers.add_parser(
+        "cat-file", help="Provide content of repository objects."
+    )
+    argsp.add_argument(
+        "type",
+        metavar="type",
+        choices=["blob", "commit", "tag", "tree"],
+        help="Specify the type of object",
+    )
+    argsp.add_argument("object", metavar="object", help="The object to display")
 
 
 def cmd_cat_file(args):
@@ -311,7 +489,11 @@ def cmd_cat_file(args):
 
 
 def cat_file(repo, obj, object_type=None):
-    obj = object_read(repo, object_find(repo, obj, object_type=object_type))
+    sha = object_find(repo, obj, object_type=object_type)
+    if object_type == b"blob":
+        obj = object_read_blob(repo, sha)
+    else:
+        obj = object_read(repo, sha)
     sys.stdout.buffer.write(obj.serialize())
 
 
@@ -319,29 +501,31 @@ def object_find(repo, name, object_type=None, follow=True):
     return name
 
 
-argsp = argsubparsers.add_parser(
-    "hash-object", help="Compute object ID and optionally creates a blob from a file"
-)
-argsp.add_argument(
-    "-t",
-    metavar="type",
-    dest="type",
-    choices=["blob", "commit", "tag", "tree"],
-    default="blob",
-    help="Specify the object type",
-)
-argsp.add_argument(
-    "-w",
-    dest="write",
-    action="store_true",
-    help="Actually write the object into the database",
-)
-argsp.add_argument("path", help="Read object from <file>")
+def _register_hash_object():
+    argsp = argsubparsers.add_parser(
+        "hash-object",
+        help="Compute object ID and optionally creates a blob from a file",
+    )
+    argsp.add_argument(
+        "-t",
+        metavar="type",
+        dest="type",
+        choices=["blob", "commit", "tag", "tree"],
+        default="blob",
+        help="Specify the object type",
+    )
+    argsp.add_argument(
+        "-w",
+        dest="write",
+        action="store_true",
+        help="Actually write the object into the database",
+    )
+    argsp.add_argument("path", help="Read object from <file>")
 
 
 def cmd_hash_object(args):
     if args.write:
-        repo = repo.find()
+        repo = repo_find()
     else:
         repo = None
 
@@ -352,6 +536,11 @@ def cmd_hash_object(args):
 
 def object_hash(fd, object_type, repo=None):
     """Hash objec, writing it to repo of provided."""
+    # Only regular files can be streamed: the blob header needs the size
+    # up front, and pipes or FIFOs don't report one
+    if object_type == b"blob" and stat.S_ISREG(os.fstat(fd.fileno()).st_mode):
+        return object_hash_blob_streaming(fd, repo)
+
     data = fd.read()
     # Choose a constructor according to object_type argument
     match object_type:
@@ -368,65 +557,125 @@ def object_hash(fd, object_type, repo=None):
     return object_write(obj, repo)
 
 
+def object_hash_blob_streaming(fd, repo=None, chunk_size=1 << 20):
+    """Hash the regular file fd as a blob, writing it to repo if provided.
+    The file is read in chunks which are fed to the hasher and the
+    compressor as they come, so memory use doesn't grow with the file."""
+    size = os.fstat(fd.fileno()).st_size
+    header = object_header(b"blob", size)
+    h = _sha1_factory()
+    h.update(header)
+
+    if not repo:
+        read = 0
+        while chunk := fd.read(chunk_size):
+            h.update(chunk)
+            read += len(chunk)
+        if read != size:
+            raise Exception("{0} changed size while being read".format(fd.name))
+        return h.hexdigest()
+
+    import tempfile
+
+    # Compress into a temporary file next to the objects, then rename it
+    # into place once we know its hash
+    co = zlib.compressobj()
+    objdir = repo_dir(repo, "objects", mkdir=True)
+    tmp = tempfile.NamedTemporaryFile(dir=objdir, delete=False)
+    try:
+        with tmp:
+            read = 0
+            tmp.write(co.compress(header))
+            while chunk := fd.read(chunk_size):
+                h.update(chunk)
+                read += len(chunk)
+                tmp.write(co.compress(chunk))
+            tmp.write(co.flush())
+
+        # The header promised size bytes, so anything else would make
+        # a corrupt object
+        if read != size:
+            raise Exception("{0} changed size while being read".format(fd.name))
+
+        sha = h.hexdigest()
+        path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
+        if not os.path.exists(path):
+            # NamedTemporaryFile creates it 0600; same mode as object_write
+            os.chmod(tmp.name, 0o444)
+            os.replace(tmp.name, path)
+    finally:
+        # Gone if it was renamed into place; otherwise clean it up
+        try:
+            os.unlink(tmp.name)
+        except FileNotFoundError:
+            pass
+    return sha
+
+
+# End of a kvlm value: a newline that isn't followed by a space, since
+# continuation lines start with one
+_KVLM_END = re.compile(rb"\n(?! )")
+
+
 def kvlm_parse(raw, start=0, dict=None):
     if not dict:
         dict = collections.OrderedDict()
         # We CANNOT declare the argument as dict = OrderedDict() or all
         # call to the functions will endlessly grow the same dict
 
-    # This function is recursive: it reads a key/value pair, then call
-    # itself back with the new position. So we first need to know
-    # where we are: at a keyword, or already in the messageQ
-
-    # We search for the next space and the next newLine.
-    space = raw.find(b" ", start)
-    endline = raw.find(b"\n", start)
-
-    # If space appears befoe newline, we have a keyword. Otherwise,
-    # it's the final message, which we just read to the end of the file.
-
-    # Base case
-    # If newline appears first (or there's no space at all, in which
-    # case find returns -1), we assume a blank line. A blank line
-    # means the remainder of the data is the message. We store it in the
-    # dictionary, with None as the key, and return.
-
-    if (space < 0) or (endline < space):
-        assert endline == start
-        dict[None] = raw[start + 1 :]
-        return dict
-
-    # Recursive case
-    # we read a key-value pair and recurse for the next
-    key = raw[start:space]
-
-    # Find the end of the value. Continuation lines begin with a
-    # space, so we loop until we find a "\n" not followed by a space
-
-    end = start
+    # This function loops over the fields: each iteration reads a
+    # key/value pair, then moves on to the next position. So we first
+    # need to know where we are: at a keyword, or already in the message.
+    # (A loop rather than recursion, so we don't pay for a Python frame
+    # per field or hit the recursion limit on pathological objects.)
+    find = raw.find
+    search = _KVLM_END.search
     while True:
-        end = raw.find(b"\n", end + 1)
-        if raw[end + 1] != ord(" "):
-            break
-
-    # Grab the value
-    # Also, drop the leading space on continuation lines
-    value = raw[space + 1 : end].replace(b"\n ", b"\n")
-
-    # Don't overwrite existing data contents
-    if key in dict:
-        if type(dict[key]) == list:
-            dict[key].append(value)
+        # We search for the next space and the next newLine.
+        space = find(b" ", start)
+        endline = find(b"\n", start)
+
+        # If space appears befoe newline, we have a keyword. Otherwise,
+        # it's the final message, which we just read to the end of the file.
+
+        # If newline appears first (or there's no space at all, in which
+        # case find returns -1), we assume a blank line. A blank line
+        # means the remainder of the data is the message. We store it in the
+        # dictionary, with None as the key, and return.
+
+        if (space < 0) or (endline < space):
+            assert endline == start
+            dict[None] = raw[start + 1 :]
+            return dict
+
+        # Otherwise we read a key-value pair and loop for the next
+        key = raw[start:space]
+
+        # Find the end of the value. Continuation lines begin with a
+        # space, so we look for the first "\n" not followed by a space.
+        # The regex does that scan in C rather than line by line here.
+        end = search(raw, space).start()
+
+        # Grab the value
+        # Also, drop the leading space on continuation lines
+        value = raw[space + 1 : end].replace(b"\n ", b"\n")
+
+        # Don't overwrite existing data contents
+        if key in dict:
+            if type(dict[key]) == list:
+                dict[key].append(value)
+            else:
+                dict[key] = [dict[key], value]
         else:
-            dict[key] = [dict[key], value]
-    else:
-        dict[key] = value
+            dict[key] = value
 
-    return kvlm_parse(raw, start=end + 1, dict=dict)
+        start = end + 1
 
 
 def kvlm_serialize(kvlm):
-    ret = b""
+    # Collect the pieces and join them once at the end: += on bytes
+    # copies everything built so far each time
+    parts = []
 
     # Output fields
     for k in kvlm.keys():
@@ -439,18 +688,20 @@ def kvlm_serialize(kvlm):
             val = [val]
 
         for v in val:
-            ret += k + b" " + (v.replace(b"\n", b"\n ")) + b"\n"
+            if b"\n" in v:
+                v = v.replace(b"\n", b"\n ")
+            parts += (k, b" ", v, b"\n")
 
     # Append message
-    ret += b"\n" + kvlm[None] + b"\n"
+    parts += (b"\n", kvlm[None], b"\n")
 
-    return ret
+    return b"".join(parts)
 
 
 class GitCommit(GitObject):
     object_type = b"commit"
 
-    def serialize(self, data):
+    def deserialize(self, data):
         self.kvlm = kvlm_parse(data)
 
     def serialize(self):
@@ -460,8 +711,18 @@ class GitCommit(GitObject):
         self.kvlm = dict()
 
 
-argsp = argsubparsers.add_parser("log", help="Display history of a given commit.")
-argsp.add_argument("commit", default="HEAD", nargs="?", help="Commit to start at.")
+object_read_commit = object_reader(GitCommit)
+
+# Constructors for object_read, by object type
+_OBJECT_TYPES = {
+    b"commit": GitCommit,
+    b"blob": GitBlob,
+}
+
+
+def _register_log():
+    argsp = argsubparsers.add_parser("log", help="Display history of a given commit.")
+    argsp.add_argument("commit", default="HEAD", nargs="?", help="Commit to start at.")
 
 
 def cmd_log(args):
@@ -473,36 +734,135 @@ def cmd_log(args):
     print("}")
 
 
+# Smallest generation of uncached commits log_graphviz reads through its
+# thread pool; anything narrower is read inline
+LOG_PARALLEL_MIN = 64
+
+
 def log_graphviz(repo, sha, seen):
-    if sha in seen:
-        return
-    seen.add(sha)
+    # Walk the history one generation at a time. Commits already in the
+    # commit cache aren't read at all. On multi-core machines, wide
+    # generations of the others are read in parallel, since decompression
+    # releases the GIL; printing stays on this thread.
+    import sqlite3
+    import concurrent.futures
+
+    frontier = [sha]
+    parallel = (os.cpu_count() or 1) > 1
+    cache = commit_cache_open(repo)
+    new_entries = []
+
+    # log walks the whole history, so load the cache in one query rather
+    # than one per commit
+    cached = dict()
+    if cache is not None:
+        try:
+            rows = cache.execute("SELECT sha, parents, message FROM commits")
+            cached = {row[0]: row[1:] for row in rows}
+        except sqlite3.Error:
+            pass
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            while frontier:
+                # dict.fromkeys drops duplicates but keeps the order
+                frontier = [s for s in dict.fromkeys(frontier) if s not in seen]
+                seen.update(frontier)
+
+                summaries = dict()
+                for s in frontier:
+                    row = cached.get(s)
+                    if row:
+                        summaries[s] = (row[0].split(), row[1])
+
+                missing = [s for s in frontier if s not in summaries]
+                if parallel and len(missing) >= LOG_PARALLEL_MIN:
+                    commits = ex.map(lambda s: object_read_commit(repo, s), missing)
+                else:
+                    # Narrow generations (nearly all of them) cost more in
+                    # pool round trips than they'd gain from it
+                    commits = [object_read_commit(repo, s) for s in missing]
+
+                for s, commit in zip(missing, commits):
+                    parents, message = summaries[s] = log_commit_summary(commit)
+                    new_entries.append((s, " ".join(parents), message))
+
+                parents_frontier = []
+                for s in frontier:
+                    parents, message = summaries[s]
+                    message = message.replace("\\", "\\\\")
+                    message = message.replace('"', '\\"')
+
+                    print(" c_{0} [label='{1}: {2}\"]".format(s, s[0:7], message))
+
+                    for p in parents:
+                        print(" c_{0} -> c_{1};".format(s, p))
+                        parents_frontier.append(p)
+
+                frontier = parents_frontier
+
+        if cache is not None:
+            # Store everything we had to read in a single transaction.
+            # The cache is best-effort: if the database can't be written
+            # (read-only, locked...) we just don't store anything.
+            try:
+                with cache:
+                    cache.executemany(
+                        "INSERT OR IGNORE INTO commits VALUES (?, ?, ?)", new_entries
+                    )
+            except sqlite3.Error:
+                pass
+    finally:
+        if cache is not None:
+            cache.close()
 
-    commit = object_read(repo, sha)
-    short_hash = sha[0:8]
-    message = commit.kvlm[None].decode("utf8").strip()
-    message = message.replace("\\", "\\\\")
-    message = message.replace('"', '\\"')
 
+def log_commit_summary(commit):
+    """What log shows of commit: the list of its parents' shas and the
+    first line of its message."""
+    message = commit.kvlm[None].decode("utf8").strip()
     if "\n" in message:  # Keep only the first line
         message = message[: message.index("\n")]
 
-    print(" c_{0} [label='{1}: {2}\"]".format(sha, sha[0:7], message))
-    assert commit.object_type == b"commit"
+    parents = commit.kvlm.get(b"parent", [])
+    if type(parents) != list:
+        parents = [parents]
 
-    if not b"parent" in commit.kvlm.keys():
-        # Base case: the initial commit
-        return
+    return [p.decode("ascii") for p in parents], message
 
-    parents = commit.kvlm[b"parent"]
 
-    if type(parents) != list:
-        parents = [parents]
+def commit_cache_open(repo):
+    """Open the commit cache of repo, a sqlite database in
+    .git/wyag-cache mapping commit shas to their log summary (see
+    log_commit_summary). Commits never change, so neither do entries.
+    Return None if the cache can't be used, eg. in a read-only repo."""
+    import sqlite3
+
+    try:
+        # Not repo_dir: a file in the way must not be an error here
+        os.makedirs(repo_path(repo, "wyag-cache"), exist_ok=True)
+        db = sqlite3.connect(repo_path(repo, "wyag-cache", "commits.db"))
+    except (OSError, sqlite3.Error):
+        return None
+
+    try:
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS commits"
+            " (sha TEXT PRIMARY KEY, parents TEXT NOT NULL, message TEXT NOT NULL)"
+        )
+    except sqlite3.Error:
+        db.close()
+        return None
+    return db
+
 
-    for p in parents:
-        p = p.decode("ascii")
-        print(" c_{0} -> c_{1};".format(sha, p))
-        log_graphviz(repo, p, seen)
+# Subparser registrars, by command name. See main.
+_SUBCMDS = {
+    "init": _register_init,
+    "cat-file": _register_cat_file,
+    "hash-object": _register_hash_object,
+    "log": _register_log,
+}
 
 
 if __name__ == "__main__":